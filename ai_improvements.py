@@ -2,6 +2,22 @@
 Improved AI Question Answering Functions
 Choose one of these based on your needs:
 """
+import re
+import os
+import heapq
+import threading
+
+# Precompiled patterns used on every question
+_NUM_RE = re.compile(r'\b\d+\.?\d*%?\b')
+_SENT_SPLIT_RE = re.compile(r'[.!?]+(?:\s+|$)')
+
+# Shared API clients, created on first use so their keep-alive connection
+# pools are reused across questions instead of re-handshaking every call
+_openai_client = None
+_anthropic_client = None
+_ollama_client = None
+_client_lock = threading.Lock()  # concurrent first calls must not each build a client
+_api_semaphore = threading.BoundedSemaphore(8)  # max concurrent provider calls
 
 # ============================================
 # OPTION 1: Enhanced Keyword Matching (No API needed)
@@ -10,45 +26,52 @@ def answer_question_enhanced(question: str, context: str) -> str:
     """
     Enhanced keyword-based Q&A with better context understanding
     """
-    import re
-    
     question_lower = question.lower()
     context_lower = context.lower()
     
     # Handle common question patterns
     if any(word in question_lower for word in ['what', 'topic', 'about', 'subject']):
         # Return first few sentences as overview
-        sentences = [s.strip() + '.' for s in context.split('.') if len(s.strip()) > 20]
+        sentences = [s.strip() + '.' for s in _SENT_SPLIT_RE.split(context) if len(s.strip()) > 20]
         if sentences:
             return f"This document discusses: {' '.join(sentences[:3])}"
     
     if any(word in question_lower for word in ['summarize', 'summary', 'overview']):
         # Create a summary
-        sentences = [s.strip() for s in context.split('.') if len(s.strip()) > 30]
+        sentences = [s.strip() for s in _SENT_SPLIT_RE.split(context) if len(s.strip()) > 30]
         summary_sentences = sentences[:5] if len(sentences) >= 5 else sentences
         return "Summary: " + ". ".join(summary_sentences) + "."
     
     if any(word in question_lower for word in ['how many', 'count', 'number']):
         # Try to find numbers in context
-        numbers = re.findall(r'\b\d+\.?\d*%?\b', context)
+        numbers = _NUM_RE.findall(context)
         if numbers:
             return f"The document mentions these numbers: {', '.join(numbers[:10])}"
     
     # Default: Find relevant sentences
-    sentences = [s.strip() for s in context.split('.') if s.strip()]
+    sentences = [s.strip() for s in _SENT_SPLIT_RE.split(context) if s.strip()]
     question_words = set(question_lower.split())
     
+    # Probe the (few) question words against each sentence instead of building
+    # a word set per sentence; the lookarounds match whole whitespace tokens
+    word_patterns = [(w, re.compile(r'(?<!\S)' + re.escape(w) + r'(?!\S)')) for w in question_words]
+    min_word_len = min(map(len, question_words), default=0)
+    
     relevant_sentences = []
     for sentence in sentences:
-        sentence_words = set(sentence.lower().split())
-        overlap = len(question_words.intersection(sentence_words))
+        sentence_lower = sentence.lower()
+        if len(sentence_lower) < min_word_len:
+            continue
+        overlap = sum(1 for w, pattern in word_patterns
+                      if w in sentence_lower and pattern.search(sentence_lower))
         if overlap > 0:
             relevant_sentences.append((overlap, sentence))
     
-    relevant_sentences.sort(reverse=True, key=lambda x: x[0])
+    # Only the top 3 are used, so avoid sorting the whole list
+    relevant_sentences = heapq.nlargest(3, relevant_sentences, key=lambda x: x[0])
     
     if relevant_sentences:
-        top_sentences = [s[1] for s in relevant_sentences[:3]]
+        top_sentences = [s[1] for s in relevant_sentences]
         return "Based on the document: " + ". ".join(top_sentences) + "."
     else:
         # Return first paragraph as fallback
@@ -61,33 +84,42 @@ def answer_question_enhanced(question: str, context: str) -> str:
 # ============================================
 # OPTION 2: OpenAI GPT Integration (Best Results!)
 # ============================================
+def get_openai_client():
+    """Return the shared OpenAI client"""
+    global _openai_client
+    with _client_lock:
+        if _openai_client is None:
+            import httpx
+            import openai
+            _openai_client = openai.OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                http_client=httpx.Client(limits=httpx.Limits(max_keepalive_connections=16))
+            )
+        return _openai_client
+
 def answer_question_openai(question: str, context: str) -> str:
     """
     Use OpenAI GPT for intelligent answers
-    Install: pip install openai
+    Install: pip install "openai>=1.0"
     Set API key: export OPENAI_API_KEY="your-key"
     """
-    import openai
-    import os
-    
-    openai.api_key = os.getenv("OPENAI_API_KEY")
-    
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",  # or "gpt-4" for better results
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant that answers questions based on document content. Be concise and accurate."
-                },
-                {
-                    "role": "user",
-                    "content": f"Document content:\n{context[:3000]}\n\nQuestion: {question}\n\nAnswer based only on the document content:"
-                }
-            ],
-            max_tokens=300,
-            temperature=0.7
-        )
+        with _api_semaphore:
+            response = get_openai_client().chat.completions.create(
+                model="gpt-3.5-turbo",  # or "gpt-4" for better results
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a helpful assistant that answers questions based on document content. Be concise and accurate."
+                    },
+                    {
+                        "role": "user",
+                        "content": f"Document content:\n{context[:3000]}\n\nQuestion: {question}\n\nAnswer based only on the document content:"
+                    }
+                ],
+                max_tokens=300,
+                temperature=0.7
+            )
         return response.choices[0].message.content.strip()
     except Exception as e:
         return f"Error calling OpenAI API: {str(e)}"
@@ -96,28 +128,37 @@ def answer_question_openai(question: str, context: str) -> str:
 # ============================================
 # OPTION 3: Anthropic Claude Integration
 # ============================================
+def get_anthropic_client():
+    """Return the shared Anthropic client"""
+    global _anthropic_client
+    with _client_lock:
+        if _anthropic_client is None:
+            import httpx
+            import anthropic
+            _anthropic_client = anthropic.Anthropic(
+                api_key=os.getenv("ANTHROPIC_API_KEY"),
+                http_client=httpx.Client(limits=httpx.Limits(max_keepalive_connections=16))
+            )
+        return _anthropic_client
+
 def answer_question_claude(question: str, context: str) -> str:
     """
     Use Anthropic Claude for answers
     Install: pip install anthropic
     Set API key: export ANTHROPIC_API_KEY="your-key"
     """
-    import anthropic
-    import os
-    
-    client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-    
     try:
-        message = client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=300,
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"Here is a document:\n\n{context[:3000]}\n\nBased ONLY on this document, please answer: {question}"
-                }
-            ]
-        )
+        with _api_semaphore:
+            message = get_anthropic_client().messages.create(
+                model="claude-3-sonnet-20240229",
+                max_tokens=300,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": f"Here is a document:\n\n{context[:3000]}\n\nBased ONLY on this document, please answer: {question}"
+                    }
+                ]
+            )
         return message.content[0].text
     except Exception as e:
         return f"Error calling Claude API: {str(e)}"
@@ -167,6 +208,15 @@ def answer_question_langchain(question: str, context: str) -> str:
 # ============================================
 # OPTION 5: Local LLM with Ollama (No API costs!)
 # ============================================
+def get_ollama_client():
+    """Return the shared Ollama client"""
+    global _ollama_client
+    with _client_lock:
+        if _ollama_client is None:
+            import ollama
+            _ollama_client = ollama.Client()
+        return _ollama_client
+
 def answer_question_ollama(question: str, context: str) -> str:
     """
     Use local Ollama models (free, runs on your machine)
@@ -174,22 +224,21 @@ def answer_question_ollama(question: str, context: str) -> str:
     Then: ollama pull llama2
     Install: pip install ollama
     """
-    import ollama
-    
     try:
-        response = ollama.chat(
-            model='llama2',  # or 'mistral', 'codellama', etc.
-            messages=[
-                {
-                    'role': 'system',
-                    'content': 'Answer questions based only on the provided document content.'
-                },
-                {
-                    'role': 'user',
-                    'content': f'Document:\n{context[:3000]}\n\nQuestion: {question}'
-                }
-            ]
-        )
+        with _api_semaphore:
+            response = get_ollama_client().chat(
+                model='llama2',  # or 'mistral', 'codellama', etc.
+                messages=[
+                    {
+                        'role': 'system',
+                        'content': 'Answer questions based only on the provided document content.'
+                    },
+                    {
+                        'role': 'user',
+                        'content': f'Document:\n{context[:3000]}\n\nQuestion: {question}'
+                    }
+                ]
+            )
         return response['message']['content']
     except Exception as e:
         return f"Error with Ollama: {str(e)}"
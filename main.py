@@ -2,17 +2,28 @@ from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
+from functools import lru_cache
 from datetime import datetime
+from collections import Counter, OrderedDict
+from threading import Lock, RLock, local
 import sqlite3
+import asyncio
 import os
+import re
+import string
 import json
+import zlib
+import heapq
+import hashlib
+import tempfile
 from pathlib import Path
 
+from starlette.concurrency import run_in_threadpool
+
 # For document processing
-import PyPDF2
+import pypdfium2 as pdfium
 import docx
-from io import BytesIO
 
 app = FastAPI(
     title="AI Document Q&A System",
@@ -33,7 +44,70 @@ app.add_middleware(
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+INDEX_DIR = Path("indexes")
+INDEX_DIR.mkdir(exist_ok=True)
+
 DB_PATH = "documents.db"
+PREVIEW_LENGTH = 200  # characters stored in documents.content_preview
+SUPPORTED_EXTENSIONS = ("pdf", "docx", "txt")
+
+_pdfium_lock = Lock()  # PDFium is not thread-safe within one process
+
+# Set by init_db(): whether this SQLite build supports the FTS5 sentence index
+FTS_ENABLED = False
+
+# Optional semantic retrieval (pip install sentence-transformers faiss-cpu)
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+SEMANTIC_MAX_DISTANCE = 0.6  # cosine distance; farther matches fall back to keywords
+SEMANTIC_EF_SEARCH = 64  # HNSW search breadth
+_embedding_model = None
+_semantic_available: Optional[bool] = None  # None until the first import attempt
+_semantic_lock = Lock()
+_semantic_indexes: Dict[int, object] = {}
+_semantic_index_locks: Dict[int, RLock] = {}  # serialize build, load and drop per document
+_semantic_index_locks_lock = Lock()
+
+# Chat history is written behind the response in batches
+HISTORY_BATCH_SIZE = 100
+HISTORY_FLUSH_INTERVAL = 0.25  # seconds
+_history_queue: Optional[asyncio.Queue] = None
+_history_task: Optional[asyncio.Task] = None
+
+# One SQLite connection per thread, reused across requests
+_tls = local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = Lock()
+_db_generation = 0  # bumped by close_db() so other threads reopen
+
+# Precompiled patterns used on every question
+_NUM_RE = re.compile(r'\b\d+\.?\d*%?\b')
+_NAME_RE = re.compile(r'\b[A-Z][a-z]+(?:\s[A-Z][a-z]+)*\b')
+_SENT_SPLIT_RE = re.compile(r'[.!?]+(?:\s+|$)')
+
+# Lowercases ASCII letters and turns punctuation into spaces in one pass
+_TOKEN_TABLE = str.maketrans({
+    **{c: ' ' for c in string.punctuation},
+    **{chr(c): chr(c + 32) for c in range(ord('A'), ord('Z') + 1)},
+})
+
+# Answer cache: document_id -> OrderedDict(normalized question -> answer)
+ANSWER_CACHE_SIZE = 1024  # entries per document
+_answer_cache: Dict[int, "OrderedDict[str, str]"] = {}
+
+# Semantic answer cache: document_id -> {normalized question -> (route, embedding)}
+# for cached questions, used when the embedding model is available
+SEMANTIC_CACHE_SIMILARITY = 0.95  # cosine similarity needed to reuse an answer
+_answer_embeddings: Dict[int, Dict[str, tuple]] = {}
+_answer_cache_lock = Lock()
+
+# Question words that send answer_from_analysis down its keyword branches
+OVERVIEW_WORDS = ['what', 'topic', 'about', 'subject', 'main', 'discuss']
+SUMMARY_WORDS = ['summarize', 'summary', 'overview', 'gist']
+COUNT_WORDS = ['how many', 'count', 'number of']
+
+# Sentence index cache: document_id -> analyzed document
+_document_cache: Dict[int, dict] = {}
 
 # Pydantic models
 class QuestionRequest(BaseModel):
@@ -52,10 +126,34 @@ class DocumentInfo(BaseModel):
     file_size: int
     content_preview: str
 
+# Database connection
+def get_db() -> sqlite3.Connection:
+    """Return this thread's SQLite connection, opening it on first use"""
+    conn = getattr(_tls, "conn", None)
+    if conn is None or getattr(_tls, "generation", None) != _db_generation:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with _connections_lock:
+            _tls.conn = conn
+            _tls.generation = _db_generation
+            _connections.append(conn)
+    return conn
+
+def close_db():
+    """Close every connection opened by get_db(); threads reopen on next use"""
+    global _db_generation
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+        _db_generation += 1
+
 # Database initialization
 def init_db():
     """Initialize SQLite database"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     # Documents table
@@ -63,12 +161,40 @@ def init_db():
         CREATE TABLE IF NOT EXISTS documents (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             filename TEXT NOT NULL,
-            content TEXT NOT NULL,
+            content BLOB NOT NULL,
             upload_date TEXT NOT NULL,
-            file_size INTEGER
+            file_size INTEGER,
+            content_preview TEXT,
+            normalized_blob BLOB,
+            content_sha256 TEXT,
+            text_length INTEGER
         )
     """)
     
+    # Add columns missing from databases created by older versions
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(documents)")]
+    if "content_preview" not in columns:
+        cursor.execute("ALTER TABLE documents ADD COLUMN content_preview TEXT")
+    if "normalized_blob" not in columns:
+        # Filled lazily by load_normalized_document() on first question
+        cursor.execute("ALTER TABLE documents ADD COLUMN normalized_blob BLOB")
+    if "content_sha256" not in columns:
+        # Older rows keep NULL and are simply not deduplicated
+        cursor.execute("ALTER TABLE documents ADD COLUMN content_sha256 TEXT")
+    if "text_length" not in columns:
+        cursor.execute("ALTER TABLE documents ADD COLUMN text_length INTEGER")
+    cursor.execute(f"UPDATE documents SET content_preview = substr(content, 1, {PREVIEW_LENGTH}) WHERE content_preview IS NULL")
+    
+    # Compress content stored as plain text by older versions
+    cursor.execute("SELECT id, content FROM documents WHERE typeof(content) = 'text'")
+    for doc_id, content in cursor.fetchall():
+        cursor.execute("UPDATE documents SET content = ? WHERE id = ?", (compress_content(content), doc_id))
+    
+    # Record the extracted text length so duplicate uploads needn't decompress content
+    cursor.execute("SELECT id, content FROM documents WHERE text_length IS NULL")
+    for doc_id, content in cursor.fetchall():
+        cursor.execute("UPDATE documents SET text_length = ? WHERE id = ?", (len(load_content(content)), doc_id))
+    
     # Chat history table
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS chat_history (
@@ -81,53 +207,409 @@ def init_db():
         )
     """)
     
+    # Indexes for per-document history and newest-first document listing
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ch_docid_ts ON chat_history(document_id, timestamp DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_docs_upload ON documents(upload_date DESC)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_docs_sha256 ON documents(content_sha256)")
+    
+    # Full-text index over document sentences (skipped if SQLite lacks FTS5)
+    # document_id is an indexed column so MATCH can be scoped to one document
+    global FTS_ENABLED
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS sentences_fts USING fts5(
+                sentence,
+                document_id,
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+        FTS_ENABLED = True
+    except sqlite3.OperationalError:
+        FTS_ENABLED = False
+    
+    # Index documents uploaded before the sentence index existed
+    if FTS_ENABLED:
+        for (doc_id,) in cursor.execute("SELECT id FROM documents").fetchall():
+            indexed = cursor.execute(
+                "SELECT 1 FROM sentences_fts WHERE sentences_fts MATCH ? LIMIT 1", (document_filter(doc_id),)
+            ).fetchone()
+            if not indexed:
+                content = cursor.execute("SELECT content FROM documents WHERE id = ?", (doc_id,)).fetchone()[0]
+                index_sentences(conn, doc_id, split_sentences(load_content(content)))
+    
     conn.commit()
-    conn.close()
 
-# Initialize database on startup
-init_db()
+# Full-text sentence index
+def document_filter(document_id: int) -> str:
+    """FTS5 query term matching only rows of one document"""
+    return f'document_id : "{int(document_id)}"'
+
+def index_sentences(conn: sqlite3.Connection, document_id: int, sentences: List[str]):
+    """Add a document's sentences to the FTS5 index"""
+    conn.executemany(
+        "INSERT INTO sentences_fts (sentence, document_id) VALUES (?, ?)",
+        [(sentence, document_id) for sentence in sentences]
+    )
+
+def search_sentences(document_id: int, words, limit: int = 3) -> List[str]:
+    """Return the best BM25-ranked sentences containing any of the words"""
+    if not FTS_ENABLED or not words:
+        return []
+    terms = " OR ".join('sentence : "' + w.replace('"', '""') + '"' for w in words)
+    query = f"{document_filter(document_id)} AND ({terms})"
+    try:
+        # The document_id column carries no weight in the ranking
+        rows = get_db().execute("""
+            SELECT sentence FROM sentences_fts
+            WHERE sentences_fts MATCH ?
+            ORDER BY bm25(sentences_fts, 1.0, 0.0), rowid
+            LIMIT ?
+        """, (query, limit)).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    return [row[0] for row in rows]
 
 # Document processing functions
-def extract_text_from_pdf(file_content: bytes) -> str:
+def extract_text_from_pdf(path: str) -> str:
     """Extract text from PDF file"""
     try:
-        pdf_reader = PyPDF2.PdfReader(BytesIO(file_content))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(path)
+            try:
+                texts = []
+                for i in range(len(pdf)):
+                    page = pdf[i]
+                    textpage = page.get_textpage()
+                    texts.append(textpage.get_text_range().replace("\r\n", "\n"))
+                    textpage.close()
+                    page.close()
+            finally:
+                pdf.close()
+        
+        return "\n".join(texts).strip()
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
 
-def extract_text_from_docx(file_content: bytes) -> str:
+def extract_text_from_docx(path: str) -> str:
     """Extract text from DOCX file"""
     try:
-        doc = docx.Document(BytesIO(file_content))
+        doc = docx.Document(path)
         text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
         return text.strip()
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error reading DOCX: {str(e)}")
 
-def extract_text_from_txt(file_content: bytes) -> str:
+def extract_text_from_txt(path: str) -> str:
     """Extract text from TXT file"""
     try:
-        return file_content.decode('utf-8').strip()
+        return Path(path).read_bytes().decode('utf-8').strip()
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error reading TXT: {str(e)}")
 
-def process_document(filename: str, file_content: bytes) -> str:
+def file_extension(filename: str) -> str:
+    """Lowercased extension of an uploaded filename"""
+    return filename.lower().split('.')[-1]
+
+def process_document(filename: str, path: str) -> str:
     """Process document based on file type"""
-    file_ext = filename.lower().split('.')[-1]
+    file_ext = file_extension(filename)
     
     if file_ext == 'pdf':
-        return extract_text_from_pdf(file_content)
+        return extract_text_from_pdf(path)
     elif file_ext == 'docx':
-        return extract_text_from_docx(file_content)
+        return extract_text_from_docx(path)
     elif file_ext == 'txt':
-        return extract_text_from_txt(file_content)
+        return extract_text_from_txt(path)
     else:
         raise HTTPException(status_code=400, detail="Unsupported file type. Please upload PDF, DOCX, or TXT files.")
 
+# Answer cache helpers
+def normalize_question(question: str) -> str:
+    """Lowercase a question and collapse whitespace.
+
+    answer_from_analysis() works only from this form, so questions that share
+    a cache key always get the same answer.
+    """
+    return " ".join(question.lower().split())
+
+def question_route(question_lower: str) -> tuple:
+    """Which keyword branches of answer_from_analysis a normalized question triggers"""
+    return (
+        any(word in question_lower for word in OVERVIEW_WORDS),
+        any(word in question_lower for word in SUMMARY_WORDS),
+        any(word in question_lower for word in COUNT_WORDS),
+        question_lower.startswith('who'),
+    )
+
+@lru_cache(maxsize=256)
+def embed_question(question_lower: str):
+    """Normalized embedding of a normalized question, or None without the model"""
+    model = get_embedding_model()
+    if model is None:
+        return None
+    import numpy as np
+    return np.asarray(model.encode([question_lower], normalize_embeddings=True), dtype='float32')[0]
+
+def get_cached_answer(document_id: int, question: str) -> Optional[str]:
+    """Return a cached answer for this document/question, or None on a miss"""
+    key = normalize_question(question)
+    with _answer_cache_lock:
+        bucket = _answer_cache.get(document_id)
+        if bucket is None:
+            return None
+        answer = bucket.get(key)
+        if answer is not None:
+            bucket.move_to_end(key)
+        return answer
+
+def get_similar_cached_answer(document_id: int, question_lower: str, embedding) -> Optional[str]:
+    """Return the cached answer to a near-identical question, or None on a miss.
+
+    Only questions taking the same keyword branch are compared, so a
+    paraphrase never gets an answer built for a different kind of question.
+    """
+    route = question_route(question_lower)
+    with _answer_cache_lock:
+        candidates = [
+            (key, vector) for key, (key_route, vector) in _answer_embeddings.get(document_id, {}).items()
+            if key_route == route
+        ]
+    if not candidates:
+        return None
+    import numpy as np
+    similarities = np.stack([vector for _, vector in candidates]) @ embedding
+    best = int(similarities.argmax())
+    if similarities[best] < SEMANTIC_CACHE_SIMILARITY:
+        return None
+    return get_cached_answer(document_id, candidates[best][0])
+
+def cache_answer(document_id: int, question: str, answer: str, embedding=None):
+    """Store an answer, evicting the least recently used entry when full"""
+    key = normalize_question(question)
+    with _answer_cache_lock:
+        bucket = _answer_cache.setdefault(document_id, OrderedDict())
+        embeddings = _answer_embeddings.setdefault(document_id, {})
+        bucket[key] = answer
+        bucket.move_to_end(key)
+        if embedding is not None:
+            embeddings[key] = (question_route(key), embedding)
+        if len(bucket) > ANSWER_CACHE_SIZE:
+            evicted, _ = bucket.popitem(last=False)
+            embeddings.pop(evicted, None)
+
+def drop_cached_answers(document_id: int):
+    """Forget every cached answer for a document"""
+    with _answer_cache_lock:
+        _answer_cache.pop(document_id, None)
+        _answer_embeddings.pop(document_id, None)
+
+# Document analysis
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase words with punctuation removed"""
+    if not text.isascii():
+        # The translate table only lowercases ASCII
+        text = text.lower()
+    return text.translate(_TOKEN_TABLE).split()
+
+def split_sentences(context: str) -> List[str]:
+    """Split text into stripped, non-empty sentences"""
+    return [s.strip() for s in _SENT_SPLIT_RE.split(context) if s.strip()]
+
+def normalize_document(context: str) -> dict:
+    """Pre-compute everything answer_question needs from the raw text"""
+    sentences = split_sentences(context)
+    paragraphs = [p.strip() for p in context.split('\n\n') if len(p.strip()) > 50]
+    return {
+        "sentences": sentences,
+        "numbers": _NUM_RE.findall(context),
+        "names": _NAME_RE.findall(context),
+        "first_paragraph": paragraphs[0] if paragraphs else "",
+        "overview": context[:500] if len(context) > 100 else "",
+    }
+
+def compress_content(text: str) -> bytes:
+    """Compress document text for the documents.content column"""
+    return zlib.compress(text.encode('utf-8'), 6)
+
+def load_content(value) -> str:
+    """Decompress a documents.content value (plain text from old rows is returned as-is)"""
+    if isinstance(value, str):
+        return value
+    return zlib.decompress(value).decode('utf-8')
+
+def pack_normalized(normalized: dict) -> bytes:
+    """Serialize a normalized document for the normalized_blob column"""
+    return zlib.compress(json.dumps(normalized).encode('utf-8'))
+
+def unpack_normalized(blob: bytes) -> dict:
+    """Inverse of pack_normalized()"""
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+def analyze_document(normalized: dict) -> dict:
+    """Build the in-memory analysis (overview lists, word -> sentence index)"""
+    sentences = normalized["sentences"]
+    long_sentences = [s for s in sentences if len(s) > 20]
+    postings: Dict[str, List[int]] = {}
+    for i, sentence in enumerate(sentences):
+        for word in set(tokenize(sentence)):
+            postings.setdefault(word, []).append(i)
+    return {
+        **normalized,
+        "long_sentences": long_sentences,  # > 20 chars, used for overviews
+        "summary_sentences": [s for s in long_sentences if len(s) > 30],
+        "top_names": [name for name, _ in Counter(normalized["names"]).most_common(10)],
+        "postings": postings,
+    }
+
+def load_normalized_document(document_id: int) -> dict:
+    """Read a document's normalized form, normalizing and storing it if missing"""
+    conn = get_db()
+    row = conn.execute("SELECT normalized_blob FROM documents WHERE id = ?", (document_id,)).fetchone()
+    if not row:
+        # Deleted since the caller looked it up; don't cache or index it again
+        raise HTTPException(status_code=404, detail="Document not found")
+    if row[0] is not None:
+        return unpack_normalized(row[0])
+    
+    # Document uploaded before normalized_blob existed
+    row = conn.execute("SELECT content FROM documents WHERE id = ?", (document_id,)).fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Document not found")
+    normalized = normalize_document(load_content(row[0]))
+    with conn:
+        conn.execute("UPDATE documents SET normalized_blob = ? WHERE id = ?", (pack_normalized(normalized), document_id))
+    return normalized
+
+def get_document_analysis(document_id: int) -> dict:
+    """Return the cached analysis for a document, loading it on first use"""
+    analysis = _document_cache.get(document_id)
+    if analysis is None:
+        analysis = analyze_document(load_normalized_document(document_id))
+        _document_cache[document_id] = analysis
+    return analysis
+
+# Semantic sentence index
+def get_embedding_model():
+    """Load the sentence embedding model, or return None if it isn't available"""
+    global _embedding_model, _semantic_available
+    with _semantic_lock:
+        if _semantic_available is None:
+            try:
+                import faiss  # noqa: F401
+                from sentence_transformers import SentenceTransformer
+                _embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+                _semantic_available = True
+            except ImportError:
+                _semantic_available = False
+            except Exception as e:
+                # e.g. the model can't be downloaded; don't retry on every question
+                print(f"⚠️ Semantic search disabled, could not load {EMBEDDING_MODEL}: {str(e)}")
+                _semantic_available = False
+        return _embedding_model
+
+def semantic_index_path(document_id: int, sentences: List[str]) -> Path:
+    """Where a document's HNSW index is stored, keyed by the sentences it covers.
+
+    Ids are reused after the database is reset, so a file named by id alone
+    could belong to a different document.
+    """
+    fingerprint = hashlib.sha256("\n".join(sentences).encode()).hexdigest()[:16]
+    return INDEX_DIR / f"{document_id}-{fingerprint}.faiss"
+
+def remove_semantic_index_files(document_id: int, keep: Optional[Path] = None):
+    """Delete a document's stored HNSW indexes (and unfinished writes) other than keep"""
+    for path in INDEX_DIR.glob(f"{document_id}-*.faiss*"):
+        if path != keep:
+            path.unlink(missing_ok=True)
+
+def semantic_index_lock(document_id: int) -> RLock:
+    """Return the lock guarding one document's HNSW index"""
+    with _semantic_index_locks_lock:
+        return _semantic_index_locks.setdefault(document_id, RLock())
+
+def document_exists(document_id: int) -> bool:
+    """Whether a document is still stored"""
+    return get_db().execute("SELECT 1 FROM documents WHERE id = ?", (document_id,)).fetchone() is not None
+
+def build_semantic_index(document_id: int, sentences: List[str]):
+    """Embed a document's sentences and persist an int8 HNSW index over them"""
+    model = get_embedding_model()
+    if model is None or not sentences:
+        return None
+    import faiss
+    import numpy as np
+    embeddings = np.asarray(model.encode(sentences, batch_size=64, normalize_embeddings=True), dtype='float32')
+    
+    # Vectors are stored as 8-bit codes (4x smaller than float32); on
+    # normalized embeddings inner product is cosine similarity
+    index = faiss.IndexHNSWSQ(EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit_uniform, 16, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = 100
+    index.train(embeddings)
+    index.add(embeddings)
+    index.hnsw.efSearch = SEMANTIC_EF_SEARCH
+    
+    with semantic_index_lock(document_id):
+        # Deleted while embedding: answer with the index but leave nothing behind
+        if not document_exists(document_id):
+            return index
+        # Write under a temporary name so a crash never leaves a partial index
+        path = semantic_index_path(document_id, sentences)
+        partial = path.with_name(path.name + ".tmp")
+        faiss.write_index(index, str(partial))
+        partial.replace(path)
+        remove_semantic_index_files(document_id, keep=path)
+        _semantic_indexes[document_id] = index
+    return index
+
+def get_semantic_index(document_id: int, sentences: List[str]):
+    """Return a document's HNSW index, loading or building it on first use"""
+    index = _semantic_indexes.get(document_id)
+    if index is not None or get_embedding_model() is None:
+        return index
+    with semantic_index_lock(document_id):
+        # Another question may have loaded or built it while this one waited
+        index = _semantic_indexes.get(document_id)
+        if index is not None:
+            return index
+        path = semantic_index_path(document_id, sentences)
+        if path.exists():
+            import faiss
+            try:
+                index = faiss.read_index(str(path))
+            except Exception as e:
+                print(f"⚠️ Rebuilding unreadable semantic index {path.name}: {str(e)}")
+                path.unlink(missing_ok=True)
+                index = None
+            if index is not None and index.ntotal == len(sentences):
+                index.hnsw.efSearch = SEMANTIC_EF_SEARCH
+                _semantic_indexes[document_id] = index
+                return index
+        return build_semantic_index(document_id, sentences)
+
+def search_semantic(document_id: int, question: str, sentences: List[str], k: int = 3) -> List[str]:
+    """Return the sentences closest in meaning to the question"""
+    try:
+        index = get_semantic_index(document_id, sentences)
+        if index is None:
+            return []
+        k = min(k, index.ntotal)
+        if k == 0:
+            return []
+        similarities, labels = index.search(embed_question(question)[None, :], k)
+    except Exception as e:
+        print(f"⚠️ Semantic search failed, using keyword search: {str(e)}")
+        return []
+    return [
+        sentences[i] for i, similarity in zip(labels[0], similarities[0])
+        if 0 <= i < len(sentences) and 1 - similarity <= SEMANTIC_MAX_DISTANCE
+    ]
+
+def drop_semantic_index(document_id: int):
+    """Forget and delete a document's HNSW index"""
+    with semantic_index_lock(document_id):
+        _semantic_indexes.pop(document_id, None)
+        remove_semantic_index_files(document_id)
+
 # Simple AI answering function - ENHANCED VERSION
 def answer_question(question: str, context: str) -> str:
     """
@@ -135,65 +617,221 @@ def answer_question(question: str, context: str) -> str:
     For production, integrate OpenAI API, Anthropic Claude, or LangChain.
     See ai_improvements.py for advanced options.
     """
-    import re
-    
-    question_lower = question.lower()
-    context_lower = context.lower()
+    return answer_from_analysis(question, analyze_document(normalize_document(context)))
+
+def answer_from_analysis(question: str, analysis: dict, document_id: Optional[int] = None) -> str:
+    """Answer a question from a document's pre-computed analysis"""
+    question_lower = normalize_question(question)
     
     # Handle "what is this about" / "topic" type questions
-    if any(word in question_lower for word in ['what', 'topic', 'about', 'subject', 'main', 'discuss']):
+    if any(word in question_lower for word in OVERVIEW_WORDS):
         # Return first few sentences as overview
-        sentences = [s.strip() + '.' for s in context.split('.') if len(s.strip()) > 20]
+        sentences = [s + '.' for s in analysis["long_sentences"][:3]]
         if sentences:
-            return f"This document discusses: {' '.join(sentences[:3])}"
+            return f"This document discusses: {' '.join(sentences)}"
     
     # Handle summary requests
-    if any(word in question_lower for word in ['summarize', 'summary', 'overview', 'gist']):
-        sentences = [s.strip() for s in context.split('.') if len(s.strip()) > 30]
-        summary_sentences = sentences[:5] if len(sentences) >= 5 else sentences
+    if any(word in question_lower for word in SUMMARY_WORDS):
+        summary_sentences = analysis["summary_sentences"][:5]
         return "📝 Summary: " + ". ".join(summary_sentences) + "."
     
     # Handle counting/number questions
-    if any(word in question_lower for word in ['how many', 'count', 'number of']):
-        numbers = re.findall(r'\b\d+\.?\d*%?\b', context)
+    if any(word in question_lower for word in COUNT_WORDS):
+        numbers = analysis["numbers"]
         if numbers:
             return f"📊 The document mentions these numbers: {', '.join(numbers[:10])}"
     
     # Handle "who", "where", "when" questions
     if question_lower.startswith('who'):
         # Look for names (capitalized words)
-        names = re.findall(r'\b[A-Z][a-z]+(?:\s[A-Z][a-z]+)*\b', context)
-        if names:
-            return f"👤 People/entities mentioned: {', '.join(set(names[:10]))}"
+        top_names = analysis["top_names"]
+        if top_names:
+            return f"👤 People/entities mentioned: {', '.join(top_names)}"
     
     # Default: Find relevant sentences with better matching
-    sentences = [s.strip() for s in context.split('.') if s.strip()]
-    question_words = set(w for w in question_lower.split() if len(w) > 3)
+    question_words = set(w for w in tokenize(question_lower) if len(w) > 3)
     
-    relevant_sentences = []
-    for sentence in sentences:
-        sentence_words = set(sentence.lower().split())
-        overlap = len(question_words.intersection(sentence_words))
-        if overlap > 0:
-            relevant_sentences.append((overlap, sentence))
+    # Prefer semantic matches, then the SQLite full-text index ranked by BM25
+    top_sentences = []
+    if document_id is not None:
+        top_sentences = search_semantic(document_id, question_lower, analysis["sentences"])
+        if not top_sentences:
+            top_sentences = search_sentences(document_id, question_words)
     
-    relevant_sentences.sort(reverse=True, key=lambda x: x[0])
+    if not top_sentences:
+        # Fall back to the in-memory index: count overlap only for sentences
+        # that share at least one question word
+        sentences = analysis["sentences"]
+        postings = analysis["postings"]
+        overlaps: Dict[int, int] = {}
+        for word in question_words:
+            for i in postings.get(word, ()):
+                overlaps[i] = overlaps.get(i, 0) + 1
+        
+        # Top 3 by overlap, earlier sentences win ties
+        relevant_sentences = heapq.nlargest(3, overlaps.items(), key=lambda x: (x[1], -x[0]))
+        top_sentences = [sentences[i] for i, _ in relevant_sentences]
     
-    if relevant_sentences:
-        top_sentences = [s[1] for s in relevant_sentences[:3]]
+    if top_sentences:
         return "📄 Based on the document: " + ". ".join(top_sentences) + "."
     else:
         # Return first paragraph as fallback
-        paragraphs = [p.strip() for p in context.split('\n\n') if len(p.strip()) > 50]
-        if paragraphs:
-            return f"ℹ️ Here's what I found in the document:\n\n{paragraphs[0]}"
+        if analysis["first_paragraph"]:
+            return f"ℹ️ Here's what I found in the document:\n\n{analysis['first_paragraph']}"
         
         # Last resort: return first 500 characters
-        if len(context) > 100:
-            return f"📖 Document overview: {context[:500]}..."
+        if analysis["overview"]:
+            return f"📖 Document overview: {analysis['overview']}..."
         
         return "❓ I couldn't find specific information to answer that question. Could you try rephrasing or ask about something specific mentioned in the document?"
 
+# Blocking helpers (called through run_in_threadpool)
+def save_upload(source, destination) -> str:
+    """Copy an upload to disk in 1 MB chunks and return its SHA-256 hex digest"""
+    digest = hashlib.sha256()
+    while True:
+        chunk = source.read(1 << 20)
+        if not chunk:
+            break
+        digest.update(chunk)
+        destination.write(chunk)
+    return digest.hexdigest()
+
+def find_document_by_hash(content_sha256: str) -> Optional[tuple]:
+    """Return (id, filename, content_preview, text_length) of a previously uploaded identical file"""
+    return get_db().execute(
+        "SELECT id, filename, content_preview, text_length FROM documents WHERE content_sha256 = ?", (content_sha256,)
+    ).fetchone()
+
+def insert_document(filename: str, text_content: str, file_size: int, content_sha256: str) -> int:
+    """Insert a processed document (and its sentence index) and return its id"""
+    normalized = normalize_document(text_content)
+    conn = get_db()
+    with conn:
+        cursor = conn.execute("""
+            INSERT INTO documents (filename, content, upload_date, file_size, content_preview, normalized_blob, content_sha256, text_length)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (filename, compress_content(text_content), datetime.now().isoformat(), file_size,
+              text_content[:PREVIEW_LENGTH], pack_normalized(normalized), content_sha256, len(text_content)))
+        if FTS_ENABLED:
+            index_sentences(conn, cursor.lastrowid, normalized["sentences"])
+    
+    # The semantic index is an optimization; uploads never fail because of it
+    try:
+        build_semantic_index(cursor.lastrowid, normalized["sentences"])
+    except Exception as e:
+        print(f"⚠️ Could not build semantic index: {str(e)}")
+    return cursor.lastrowid
+
+def generate_answer(document_id: int, question: str) -> str:
+    """Answer a question from a document's cached, pre-normalized form and cache it.
+
+    A near-identical earlier question's answer is reused when the embedding
+    model is available.
+    """
+    question_lower = normalize_question(question)
+    try:
+        embedding = embed_question(question_lower)
+    except Exception as e:
+        print(f"⚠️ Could not embed question, skipping the semantic answer cache: {str(e)}")
+        embedding = None
+    
+    answer = None
+    if embedding is not None:
+        answer = get_similar_cached_answer(document_id, question_lower, embedding)
+    if answer is None:
+        answer = answer_from_analysis(question, get_document_analysis(document_id), document_id)
+    cache_answer(document_id, question, answer, embedding)
+    return answer
+
+def save_chat_messages(rows: List[tuple]):
+    """Record (document_id, question, answer, timestamp) rows in one transaction"""
+    conn = get_db()
+    with conn:
+        # Skip rows whose document was deleted while they were queued
+        conn.executemany("""
+            INSERT INTO chat_history (document_id, question, answer, timestamp)
+            SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM documents WHERE id = ?)
+        """, [(*row, row[0]) for row in rows])
+
+# Background chat history writer
+async def history_writer():
+    """Drain the history queue, flushing every HISTORY_BATCH_SIZE rows or HISTORY_FLUSH_INTERVAL.
+
+    A queued Future asks for an immediate flush and is resolved once the rows
+    queued before it are written.
+    """
+    loop = asyncio.get_running_loop()
+    running = True
+    while running:
+        item = await _history_queue.get()
+        rows, waiter = [], None
+        deadline = loop.time() + HISTORY_FLUSH_INTERVAL
+        while True:
+            if item is None:
+                running = False
+                break
+            if isinstance(item, asyncio.Future):
+                waiter = item
+                break
+            rows.append(item)
+            timeout = deadline - loop.time()
+            if len(rows) >= HISTORY_BATCH_SIZE or timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_history_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+        if rows:
+            try:
+                await run_in_threadpool(save_chat_messages, rows)
+            except Exception as e:
+                print(f"⚠️ Could not save chat history: {str(e)}")
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+@app.on_event("startup")
+async def start_history_writer():
+    """Start the background chat history writer"""
+    global _history_queue, _history_task
+    _history_queue = asyncio.Queue()
+    _history_task = asyncio.create_task(history_writer())
+
+@app.on_event("shutdown")
+async def stop_history_writer():
+    """Flush queued chat history and stop the writer"""
+    global _history_task
+    task, _history_task = _history_task, None
+    if task is not None:
+        # Later rows are written directly by record_chat_message
+        await _history_queue.put(None)
+        await task
+
+async def flush_chat_history():
+    """Wait until every queued chat history row has been written"""
+    task = _history_task
+    if task is not None and not task.done():
+        waiter = asyncio.get_running_loop().create_future()
+        _history_queue.put_nowait(waiter)
+        await asyncio.wait([waiter, task], return_when=asyncio.FIRST_COMPLETED)
+
+async def record_chat_message(row: tuple):
+    """Queue a chat history row, writing it directly when the writer isn't running"""
+    if _history_task is not None and not _history_task.done():
+        _history_queue.put_nowait(row)
+    else:
+        await run_in_threadpool(save_chat_messages, [row])
+
+@app.on_event("startup")
+def startup_db():
+    """Create or migrate the database before serving requests, not at import time"""
+    init_db()
+
+@app.on_event("shutdown")
+def shutdown_db():
+    """Close pooled database connections"""
+    close_db()
+
 # API Endpoints
 @app.get("/")
 async def root():
@@ -212,48 +850,65 @@ async def root():
 @app.post("/upload")
 async def upload_document(file: UploadFile = File(...)):
     """Upload a document (PDF, DOCX, TXT)"""
+    tmp_path = None
     try:
-        # Read file content
-        content = await file.read()
+        # Reject unsupported types before a duplicate lookup could accept them
+        if file_extension(file.filename) not in SUPPORTED_EXTENSIONS:
+            raise HTTPException(status_code=400, detail="Unsupported file type. Please upload PDF, DOCX, or TXT files.")
         
-        # Extract text
-        text_content = process_document(file.filename, content)
+        # Stream the upload to disk instead of holding it in memory, hashing as we go
+        with tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, delete=False) as tmp:
+            tmp_path = tmp.name
+            content_sha256 = await run_in_threadpool(save_upload, file.file, tmp)
+        file_size = os.path.getsize(tmp_path)
         
-        if not text_content or len(text_content) < 10:
-            raise HTTPException(status_code=400, detail="Document appears to be empty or too short")
+        # Identical file already stored: return it without re-extracting
+        existing = await run_in_threadpool(find_document_by_hash, content_sha256)
         
-        # Save to database
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO documents (filename, content, upload_date, file_size)
-            VALUES (?, ?, ?, ?)
-        """, (file.filename, text_content, datetime.now().isoformat(), len(content)))
-        conn.commit()
-        doc_id = cursor.lastrowid
-        conn.close()
+        if existing is None:
+            # Extract text (blocking parser work runs off the event loop)
+            text_content = await run_in_threadpool(process_document, file.filename, tmp_path)
+            
+            if not text_content or len(text_content) < 10:
+                raise HTTPException(status_code=400, detail="Document appears to be empty or too short")
+            
+            # Save to database
+            try:
+                doc_id = await run_in_threadpool(insert_document, file.filename, text_content, file_size, content_sha256)
+                filename = file.filename
+                preview, characters = text_content[:PREVIEW_LENGTH], len(text_content)
+            except sqlite3.IntegrityError:
+                # The same file was stored by a concurrent upload
+                existing = await run_in_threadpool(find_document_by_hash, content_sha256)
+                if existing is None:
+                    raise
+        
+        if existing is not None:
+            doc_id, filename, preview, characters = existing
         
         return {
             "success": True,
-            "message": "Document uploaded successfully",
+            "message": "Document already uploaded" if existing else "Document uploaded successfully",
             "document_id": doc_id,
-            "filename": file.filename,
-            "characters": len(text_content),
-            "preview": text_content[:200] + "..." if len(text_content) > 200 else text_content
+            "filename": filename,
+            "duplicate": existing is not None,
+            "characters": characters,
+            "preview": preview + "..." if characters > PREVIEW_LENGTH else preview
         }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
 
 @app.get("/documents")
 async def get_documents():
     """Get all uploaded documents"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, filename, upload_date, file_size, content FROM documents ORDER BY upload_date DESC")
+    cursor = get_db().cursor()
+    cursor.execute("SELECT id, filename, upload_date, file_size, content_preview FROM documents ORDER BY upload_date DESC")
     rows = cursor.fetchall()
-    conn.close()
     
     documents = []
     for row in rows:
@@ -271,35 +926,31 @@ async def get_documents():
 async def ask_question(request: QuestionRequest):
     """Ask a question about a document"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = get_db().cursor()
         
-        # Get document content
+        # Find the document
         if request.document_id:
-            cursor.execute("SELECT content, filename FROM documents WHERE id = ?", (request.document_id,))
+            cursor.execute("SELECT filename FROM documents WHERE id = ?", (request.document_id,))
             result = cursor.fetchone()
             if not result:
                 raise HTTPException(status_code=404, detail="Document not found")
-            context, filename = result
+            filename = result[0]
         else:
             # Use the most recent document
-            cursor.execute("SELECT id, content, filename FROM documents ORDER BY upload_date DESC LIMIT 1")
+            cursor.execute("SELECT id, filename FROM documents ORDER BY upload_date DESC LIMIT 1")
             result = cursor.fetchone()
             if not result:
                 raise HTTPException(status_code=404, detail="No documents uploaded yet")
-            request.document_id, context, filename = result
+            request.document_id, filename = result
         
-        # Generate answer
-        answer = answer_question(request.question, context)
+        # Generate answer (the document is only analyzed on a cache miss)
+        answer = get_cached_answer(request.document_id, request.question)
+        if answer is None:
+            answer = await run_in_threadpool(generate_answer, request.document_id, request.question)
         
         # Save to chat history
         timestamp = datetime.now().isoformat()
-        cursor.execute("""
-            INSERT INTO chat_history (document_id, question, answer, timestamp)
-            VALUES (?, ?, ?, ?)
-        """, (request.document_id, request.question, answer, timestamp))
-        conn.commit()
-        conn.close()
+        await record_chat_message((request.document_id, request.question, answer, timestamp))
         
         return {
             "question": request.question,
@@ -316,8 +967,7 @@ async def ask_question(request: QuestionRequest):
 @app.get("/history")
 async def get_chat_history(document_id: Optional[int] = None, limit: int = 20):
     """Get chat history"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    cursor = get_db().cursor()
     
     if document_id:
         cursor.execute("""
@@ -338,7 +988,6 @@ async def get_chat_history(document_id: Optional[int] = None, limit: int = 20):
         """, (limit,))
     
     rows = cursor.fetchall()
-    conn.close()
     
     history = []
     for row in rows:
@@ -354,34 +1003,42 @@ async def get_chat_history(document_id: Optional[int] = None, limit: int = 20):
 @app.delete("/documents/{document_id}")
 async def delete_document(document_id: int):
     """Delete a document and its chat history"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     
     # Check if document exists
     cursor.execute("SELECT id FROM documents WHERE id = ?", (document_id,))
     if not cursor.fetchone():
-        conn.close()
         raise HTTPException(status_code=404, detail="Document not found")
     
     # Delete chat history
     cursor.execute("DELETE FROM chat_history WHERE document_id = ?", (document_id,))
     
-    # Delete document
+    # Delete document and its sentence index
     cursor.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+    if FTS_ENABLED:
+        cursor.execute(
+            "DELETE FROM sentences_fts WHERE rowid IN (SELECT rowid FROM sentences_fts WHERE sentences_fts MATCH ?)",
+            (document_filter(document_id),)
+        )
     
     conn.commit()
-    conn.close()
+    
+    # Drop cached answers, analysis and semantic index for this document
+    drop_cached_answers(document_id)
+    _document_cache.pop(document_id, None)
+    await run_in_threadpool(drop_semantic_index, document_id)  # waits out a build in progress
     
     return {"success": True, "message": "Document deleted successfully"}
 
 @app.delete("/history")
 async def clear_history():
     """Clear all chat history"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM chat_history")
+    # Write queued rows first so they can't reappear after the delete
+    await flush_chat_history()
+    conn = get_db()
+    conn.execute("DELETE FROM chat_history")
     conn.commit()
-    conn.close()
     
     return {"success": True, "message": "Chat history cleared"}
 
@@ -16,7 +16,7 @@ echo "✅ Python 3 found"
 # Check if required packages are installed
 echo ""
 echo "📦 Installing dependencies..."
-pip3 install -q fastapi uvicorn python-multipart PyPDF2 python-docx 2>/dev/null
+pip3 install -q fastapi uvicorn python-multipart pypdfium2 python-docx 2>/dev/null
 
 if [ $? -eq 0 ]; then
     echo "✅ Dependencies installed"